@@ -5,6 +5,8 @@ from typing import List, Optional
 import uvicorn
 import os
 import uuid
+import asyncio
+from joblib import Parallel, delayed
 from datetime import datetime
 import json
 
@@ -30,9 +32,9 @@ PROCESSED_DIR = "processed"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(PROCESSED_DIR, exist_ok=True)
 
-# In-memory storage for job status and chat history
-job_status = {}
-chat_sessions = {}
+# Job status and chat history (Redis when REDIS_URL is set, in-memory otherwise)
+from state_store import StateStore
+store = StateStore()
 
 # Models
 class ChatMessage(BaseModel):
@@ -84,32 +86,34 @@ async def upload_files(
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail=f"Only PDF files allowed: {file.filename}")
         
-        # Check file size (10MB limit)
-        content = await file.read()
-        if len(content) > 10 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail=f"File too large: {file.filename}")
-        
-        # Save file
+        # Stream to disk in 1MB chunks, enforcing the 10MB limit incrementally
         file_path = os.path.join(UPLOAD_DIR, f"{job_id}_{file.filename}")
+        size = 0
         with open(file_path, "wb") as f:
-            f.write(content)
-        
+            while chunk := await file.read(1 << 20):
+                size += len(chunk)
+                if size > 10 * 1024 * 1024:
+                    f.close()
+                    os.remove(file_path)
+                    raise HTTPException(status_code=400, detail=f"File too large: {file.filename}")
+                f.write(chunk)
+
         file_paths.append({
             "filename": file.filename,
             "path": file_path,
-            "size": len(content),
+            "size": size,
             "upload_time": datetime.now().isoformat()
         })
     
     # Initialize job status
-    job_status[job_id] = {
+    await store.set_job(job_id, {
         "status": "pending",
         "progress": 0,
         "message": "Files uploaded, processing started",
         "files_processed": 0,
         "total_files": len(files),
         "files": file_paths
-    }
+    })
     
     # Process documents in background
     background_tasks.add_task(process_documents_task, job_id, file_paths)
@@ -121,24 +125,42 @@ async def process_documents_task(job_id: str, file_paths: List[dict]):
     Background task to process documents
     """
     try:
-        job_status[job_id]["status"] = "processing"
-        job_status[job_id]["message"] = "Extracting text from PDFs"
-        
-        all_chunks = []
-        
-        for idx, file_info in enumerate(file_paths):
-            job_status[job_id]["progress"] = int((idx / len(file_paths)) * 50)
-            job_status[job_id]["message"] = f"Processing {file_info['filename']}"
-            
-            # Extract text and create chunks
-            chunks = doc_processor.process_pdf(file_info['path'], file_info['filename'])
-            all_chunks.extend(chunks)
-            
-            job_status[job_id]["files_processed"] = idx + 1
-        
+        await store.update_job(job_id, status="processing", message="Extracting text from PDFs")
+
+        # Extract and chunk each PDF in loky worker processes (CPU-bound work;
+        # loky reuses warm interpreters across uploads). Runs in a thread so
+        # the event loop stays free, with progress pushed back as files finish.
+        loop = asyncio.get_running_loop()
+
+        def extract_all():
+            results = []
+            parallel = Parallel(n_jobs=-1, backend="loky", return_as="generator")
+            jobs = (
+                delayed(doc_processor.process_pdf)(file_info['path'], file_info['filename'])
+                for file_info in file_paths
+            )
+            for chunks in parallel(jobs):
+                results.append(chunks)
+                done = len(results)
+                asyncio.run_coroutine_threadsafe(
+                    store.update_job(
+                        job_id,
+                        files_processed=done,
+                        progress=int((done / len(file_paths)) * 50),
+                        message=f"Processed {done}/{len(file_paths)} files"
+                    ),
+                    loop
+                )
+            return results
+
+        # Collect chunks in upload order (parallel-list layout from create_chunks)
+        all_chunks = {"texts": [], "sources": [], "chunk_ids": [], "char_counts": []}
+        for chunks in await loop.run_in_executor(None, extract_all):
+            for key in all_chunks:
+                all_chunks[key].extend(chunks[key])
+
         # Generate embeddings and store in Pinecone
-        job_status[job_id]["progress"] = 60
-        job_status[job_id]["message"] = "Generating embeddings"
+        await store.update_job(job_id, progress=60, message="Generating embeddings")
         
         await rag_engine.store_embeddings(all_chunks, job_id)
         
@@ -148,27 +170,30 @@ async def process_documents_task(job_id: str, file_paths: List[dict]):
             json.dump({
                 "job_id": job_id,
                 "files": file_paths,
-                "chunks_count": len(all_chunks),
+                "chunks_count": len(all_chunks["texts"]),
                 "processed_at": datetime.now().isoformat()
             }, f)
         
-        job_status[job_id]["status"] = "completed"
-        job_status[job_id]["progress"] = 100
-        job_status[job_id]["message"] = "Processing completed successfully"
-        
+        await store.update_job(
+            job_id,
+            status="completed",
+            progress=100,
+            message="Processing completed successfully"
+        )
+
     except Exception as e:
-        job_status[job_id]["status"] = "failed"
-        job_status[job_id]["message"] = f"Error: {str(e)}"
+        await store.update_job(job_id, status="failed", message=f"Error: {str(e)}")
 
 @app.get("/upload-status/{job_id}")
 async def get_upload_status(job_id: str):
     """
     Get processing status for a job
     """
-    if job_id not in job_status:
+    status = await store.get_job(job_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    
-    return job_status[job_id]
+
+    return status
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(chat_message: ChatMessage):
@@ -176,28 +201,24 @@ async def chat(chat_message: ChatMessage):
     Handle chat messages and return responses
     """
     session_id = chat_message.session_id or str(uuid.uuid4())
-    
-    # Initialize session if new
-    if session_id not in chat_sessions:
-        chat_sessions[session_id] = []
-    
+
     # Get chat history
-    history = chat_sessions[session_id]
-    
+    history = await store.get_history(session_id)
+
     try:
         # Get response from RAG engine
         response, sources = await rag_engine.get_response(
             query=chat_message.message,
             history=history
         )
-        
+
         # Update chat history
-        chat_sessions[session_id].append({
+        await store.append_message(session_id, {
             "role": "user",
             "content": chat_message.message,
             "timestamp": datetime.now().isoformat()
         })
-        chat_sessions[session_id].append({
+        await store.append_message(session_id, {
             "role": "assistant",
             "content": response,
             "timestamp": datetime.now().isoformat()
@@ -220,19 +241,16 @@ async def get_chat_history(session_id: str):
     """
     Retrieve conversation history
     """
-    if session_id not in chat_sessions:
-        return {"session_id": session_id, "history": []}
-    
-    return {"session_id": session_id, "history": chat_sessions[session_id]}
+    history = await store.get_history(session_id)
+    return {"session_id": session_id, "history": history}
 
 @app.delete("/chat/clear/{session_id}")
 async def clear_chat(session_id: str):
     """
     Clear conversation context
     """
-    if session_id in chat_sessions:
-        chat_sessions[session_id] = []
-    
+    await store.clear_session(session_id)
+
     return {"message": "Chat history cleared", "session_id": session_id}
 
 @app.get("/health")
@@ -243,8 +261,8 @@ async def health_check():
     return {
         "status": "healthy",
         "pinecone_connected": rag_engine.is_connected(),
-        "active_jobs": len(job_status),
-        "active_sessions": len(chat_sessions)
+        "active_jobs": await store.job_count(),
+        "active_sessions": await store.session_count()
     }
 
 if __name__ == "__main__":
@@ -1,27 +1,154 @@
 import os
+import re
+import time
+import asyncio
+import threading
+import itertools
+import functools
+import hashlib
+from collections import OrderedDict
 from typing import List, Dict, Tuple
-from pinecone import Pinecone, ServerlessSpec
-from sentence_transformers import SentenceTransformer
-import requests
+from pinecone import ServerlessSpec
+# gRPC client: protobuf encoding + HTTP/2 multiplexing beats REST/JSON for
+# upsert/query throughput; fall back to REST when the extra isn't installed
+try:
+    from pinecone.grpc import PineconeGRPC as Pinecone
+    GRPC_ENABLED = True
+except ImportError:
+    from pinecone import Pinecone
+    GRPC_ENABLED = False
+from sentence_transformers import SentenceTransformer, CrossEncoder
+import torch
+import httpx
 import json
+import numpy as np
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Queries with a quoted phrase want literal lookup - skip the reranker for those
+_QUOTED_PHRASE = re.compile(r'"[^"]+"')
+
+# Cross-encoder for reranking prefetched contexts. The 22M-parameter
+# ms-marco MiniLM scores 30 pairs in tens of ms on CPU; larger models
+# (e.g. BAAI/bge-reranker-v2-m3) blow the per-turn latency budget there.
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Quantize embeddings to int8-range integers before sending to Pinecone.
+# Cosine similarity is scale-invariant, so integer-valued vectors rank the
+# same up to quantization error while the JSON payload shrinks ~4x.
+# Set EMBED_INT8=0 to keep full-precision floats.
+EMBED_INT8 = os.getenv("EMBED_INT8", "1") == "1"
+
+# Fixed instructions sent as the system message on every chat turn; keeping
+# them out of the user turn frees truncation budget for retrieved context
+SYSTEM_PROMPT = """You are a helpful AI assistant answering questions based on provided documents.
+
+Instructions:
+1. Answer the question based ONLY on the provided context
+2. Be specific and cite sources when possible
+3. If the context doesn't contain the answer, say so
+4. Keep your answer concise and relevant
+5. Maintain conversation continuity if there's previous context
+6. No special characters and response should be in plain text"""
+
+# Process-wide embedding model, loaded lazily on first use so FastAPI
+# startup (and each uvicorn worker) doesn't block on the ~90MB model load
+_EMBEDDING_MODEL = None
+
+def _get_embedding_model() -> SentenceTransformer:
+    global _EMBEDDING_MODEL
+    if _EMBEDDING_MODEL is None:
+        # GPU gets FP16; CPU prefers the int8 ONNX export (VNNI kernels)
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        if device == "cuda":
+            model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+            model.half()
+        else:
+            try:
+                model = SentenceTransformer(
+                    'all-MiniLM-L6-v2',
+                    backend='onnx',
+                    model_kwargs={'file_name': 'model_qint8_avx512_vnni.onnx'}
+                )
+            except Exception as e:
+                print(f"ONNX backend unavailable ({e}), falling back to PyTorch")
+                model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+        _EMBEDDING_MODEL = model
+    return _EMBEDDING_MODEL
+
+def _is_transient(error: Exception) -> bool:
+    """
+    Whether an upsert failure is worth retrying: REST 429/5xx responses,
+    or their gRPC status-code equivalents
+    """
+    status = getattr(error, 'status', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # gRPC surfaces PineconeException wrapping an RpcError; the status code
+    # lives on whichever of the two exposes code()
+    for exc in (error, error.__cause__):
+        code = getattr(exc, 'code', None)
+        if callable(code):
+            try:
+                return code().name in (
+                    'RESOURCE_EXHAUSTED', 'UNAVAILABLE', 'INTERNAL', 'DEADLINE_EXCEEDED'
+                )
+            except Exception:
+                return False
+    return False
+
+def _quantize_int8(embedding: "np.ndarray") -> List[int]:
+    """
+    Map a normalized embedding (components in [-1, 1]) onto [-127, 127]
+    """
+    q = np.clip(np.round(embedding * 127), -128, 127).astype(np.int8)
+    return [int(v) for v in q]
+
+def _batched(iterable, batch_size: int = 100):
+    """
+    Break an iterable into batches of batch_size
+    """
+    it = iter(iterable)
+    batch = list(itertools.islice(it, batch_size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(it, batch_size))
+
 class RAGEngine:
     """
     Retrieval-Augmented Generation engine using Pinecone and Sarvam AI
     """
     
     def __init__(self):
-        # Initialize Pinecone
-        self.pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+        # Initialize Pinecone. The REST client takes pool_threads here (it
+        # backs async_req upserts); the gRPC client manages its own channel.
+        if GRPC_ENABLED:
+            self.pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+        else:
+            self.pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"), pool_threads=30)
         self.index_name = os.getenv("PINECONE_INDEX_NAME", "rag-chatbot")
         
-        # Initialize embedding model (local)
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Embedding model is loaded lazily via the embedding_model property
         self.embedding_dimension = 384  # Dimension for all-MiniLM-L6-v2
+
+        # Cross-encoder reranker (loaded lazily on first retrieval)
+        self._reranker = None
+
+        # Pooled HTTP client for LLM calls (keeps TCP/TLS connections warm)
+        self._http = httpx.AsyncClient(http2=True, timeout=45)
+
+        # Last successful connectivity check (liveness probes hit /health often)
+        self._last_ok = 0.0
         
+        # Caches for repeated queries: embeddings (LRU) and contexts (TTL)
+        self._embed_cache = functools.lru_cache(maxsize=512)(self._embed_one)
+        self._ctx_cache: OrderedDict = OrderedDict()  # key -> (timestamp, contexts)
+        self._ctx_cache_ttl = 900  # 15 minutes
+        self._ctx_cache_max = 256
+        # retrieve_context runs on executor threads; guard cache mutations
+        self._ctx_cache_lock = threading.Lock()
+
         # Create or connect to index
         self._setup_index()
     
@@ -51,66 +178,139 @@ class RAGEngine:
         except Exception as e:
             raise Exception(f"Error setting up Pinecone index: {str(e)}")
     
+    @property
+    def embedding_model(self) -> SentenceTransformer:
+        return _get_embedding_model()
+
+    def _get_reranker(self) -> CrossEncoder:
+        """
+        Lazily load the cross-encoder reranker
+        """
+        if self._reranker is None:
+            self._reranker = CrossEncoder(RERANKER_MODEL)
+        return self._reranker
+
+    def _embed_one(self, query: str) -> List[float]:
+        """
+        Single-query fast path: skips the batching machinery in
+        generate_embeddings (wrapped by an LRU cache in __init__)
+        """
+        embedding = self.embedding_model.encode(
+            query,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            normalize_embeddings=True
+        )
+        if EMBED_INT8:
+            return _quantize_int8(embedding)
+        return embedding.tolist()
+
     def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
         """
         Generate embeddings using SentenceTransformer
         """
         try:
-            embeddings = self.embedding_model.encode(texts, show_progress_bar=True)
+            embeddings = self.embedding_model.encode(
+                texts,
+                batch_size=128,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            if EMBED_INT8:
+                return [_quantize_int8(embedding) for embedding in embeddings]
             return embeddings.tolist()
         except Exception as e:
             raise Exception(f"Error generating embeddings: {str(e)}")
     
-    async def store_embeddings(self, chunks: List[Dict], job_id: str):
+    async def store_embeddings(self, chunks: Dict[str, list], job_id: str):
         """
-        Store embeddings in Pinecone
+        Store embeddings in Pinecone (chunks arrive as parallel lists).
+        Encoding, the upsert wait loop, and the retry backoff all block,
+        so the body runs off the event loop.
         """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, functools.partial(self._store_embeddings, chunks, job_id)
+        )
+
+    def _store_embeddings(self, chunks: Dict[str, list], job_id: str):
         try:
-            # Prepare texts for embedding
-            texts = [chunk["text"] for chunk in chunks]
-            
+            texts = chunks["texts"]
+
             # Generate embeddings
             embeddings = self.generate_embeddings(texts)
-            
+
             # Prepare vectors for upsert
             vectors = []
-            for idx, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                vector_id = f"{job_id}_{chunk['metadata']['source']}_{idx}"
+            for idx, (text, source, chunk_id, embedding) in enumerate(
+                zip(texts, chunks["sources"], chunks["chunk_ids"], embeddings)
+            ):
                 vectors.append({
-                    "id": vector_id,
+                    "id": f"{job_id}_{source}_{idx}",
                     "values": embedding,
                     "metadata": {
-                        "text": chunk["text"],
-                        "source": chunk["metadata"]["source"],
-                        "chunk_id": chunk["metadata"]["chunk_id"],
+                        "text": text,
+                        "source": source,
+                        "chunk_id": chunk_id,
                         "job_id": job_id
                     }
                 })
             
-            # Upsert in batches
-            batch_size = 100
-            for i in range(0, len(vectors), batch_size):
-                batch = vectors[i:i + batch_size]
-                self.index.upsert(vectors=batch)
-            
+            # Upsert batches in parallel (overlaps HTTPS round-trips)
+            batches = list(_batched(vectors, 100))
+            async_results = [
+                self.index.upsert(vectors=batch, async_req=True)
+                for batch in batches
+            ]
+
+            # Wait for all upserts, retrying transient failures with backoff.
+            # gRPC returns PineconeGrpcFuture (.result()); REST returns an
+            # AsyncResult (.get()).
+            for batch, result in zip(batches, async_results):
+                for attempt in range(3):
+                    try:
+                        result.result() if GRPC_ENABLED else result.get()
+                        break
+                    except Exception as e:
+                        if attempt < 2 and _is_transient(e):
+                            time.sleep(2 ** attempt)
+                            result = self.index.upsert(vectors=batch, async_req=True)
+                        else:
+                            raise
+
+            # New documents invalidate previously cached retrievals
+            with self._ctx_cache_lock:
+                self._ctx_cache.clear()
+
         except Exception as e:
             raise Exception(f"Error storing embeddings: {str(e)}")
     
-    def retrieve_context(self, query: str, top_k: int = 5) -> List[Dict]:
+    def retrieve_context(self, query: str, prefetch_k: int = 30, rerank_k: int = 5) -> List[Dict]:
         """
-        Retrieve relevant context from Pinecone
+        Retrieve relevant context: prefetch from Pinecone, rerank with a cross-encoder
         """
         try:
-            # Generate query embedding
-            query_embedding = self.generate_embeddings([query])[0]
-            
-            # Search in Pinecone
+            # Serve repeated queries from the TTL cache
+            key = hashlib.sha1(f"{prefetch_k}:{rerank_k}:{query}".encode()).hexdigest()
+            with self._ctx_cache_lock:
+                cached = self._ctx_cache.get(key)
+                if cached is not None:
+                    ts, contexts = cached
+                    if time.monotonic() - ts < self._ctx_cache_ttl:
+                        return contexts
+                    self._ctx_cache.pop(key, None)
+
+            # Generate query embedding (LRU-cached)
+            query_embedding = self._embed_cache(query)
+
+            # Prefetch a wide candidate set from Pinecone (cheap vector search)
             results = self.index.query(
                 vector=query_embedding,
-                top_k=top_k,
+                top_k=prefetch_k,
                 include_metadata=True
             )
-            
+
             # Extract and format results
             contexts = []
             for match in results.matches:
@@ -120,13 +320,30 @@ class RAGEngine:
                     "score": match.score,
                     "chunk_id": match.metadata.get("chunk_id", 0)
                 })
-            
+
+            # Rerank candidates with the cross-encoder and keep the best few.
+            # Quoted-phrase queries want literal matches, so keep vector order.
+            if len(contexts) > rerank_k and not _QUOTED_PHRASE.search(query):
+                scores = self._get_reranker().predict(
+                    [(query, ctx["text"]) for ctx in contexts]
+                )
+                for ctx, score in zip(contexts, scores):
+                    ctx["score"] = float(score)
+                contexts.sort(key=lambda ctx: ctx["score"], reverse=True)
+            contexts = contexts[:rerank_k]
+
+            # Cache the result, evicting the oldest entry when full
+            with self._ctx_cache_lock:
+                self._ctx_cache[key] = (time.monotonic(), contexts)
+                while len(self._ctx_cache) > self._ctx_cache_max:
+                    self._ctx_cache.popitem(last=False)
+
             return contexts
-        
+
         except Exception as e:
             raise Exception(f"Error retrieving context: {str(e)}")
     
-    def call_llm_api(self, prompt: str) -> str:
+    async def call_llm_api(self, prompt: str) -> str:
         """
         Call Sarvam AI for text generation
         """
@@ -160,6 +377,10 @@ class RAGEngine:
             payload = {
                 "model": "sarvam-m",
                 "messages": [
+                    {
+                        "role": "system",
+                        "content": SYSTEM_PROMPT
+                    },
                     {
                         "role": "user",
                         "content": prompt
@@ -170,7 +391,7 @@ class RAGEngine:
                 "top_p": 0.9
             }
             
-            response = requests.post(url, headers=headers, json=payload, timeout=45)
+            response = await self._http.post(url, headers=headers, json=payload)
             
             # Debug logging
             print(f"Sarvam Response Status: {response.status_code}")
@@ -189,9 +410,9 @@ class RAGEngine:
                 print(f"Unexpected Sarvam response format: {result}")
                 raise Exception("Unexpected response format from Sarvam AI")
         
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             error_msg = f"Sarvam AI API error: {str(e)}"
-            if hasattr(e, 'response') and e.response is not None:
+            if getattr(e, 'response', None) is not None:
                 error_msg += f"\nResponse: {e.response.text}"
             raise Exception(error_msg)
         except (KeyError, IndexError) as e:
@@ -202,8 +423,13 @@ class RAGEngine:
         Generate response using RAG
         """
         try:
-            # Retrieve relevant context
-            contexts = self.retrieve_context(query, top_k=5)
+            # Retrieve relevant context (prefetch wide, rerank down to 5).
+            # Embedding, the Pinecone query, and reranking are all blocking,
+            # so run them off the event loop.
+            loop = asyncio.get_running_loop()
+            contexts = await loop.run_in_executor(
+                None, functools.partial(self.retrieve_context, query, 30, 5)
+            )
             
             if not contexts:
                 return "I don't have enough information to answer that question based on the uploaded documents.", []
@@ -223,25 +449,15 @@ class RAGEngine:
                     for msg in recent_history
                 ])
             
-            # Create prompt for Sarvam AI
-            prompt = f"""You are a helpful AI assistant answering questions based on provided documents.
-
-Context from documents:
+            # User turn carries only the per-request parts; the fixed
+            # instructions ride along as the system message
+            user_content = f"""Context from documents:
 {context_text}
 
-{f"Previous conversation:{chr(10)}{history_text}{chr(10)}{chr(10)}" if history_text else ""}User Question: {query}
+{f"Previous conversation:{chr(10)}{history_text}{chr(10)}{chr(10)}" if history_text else ""}Question: {query}"""
 
-Instructions:
-1. Answer the question based ONLY on the provided context
-2. Be specific and cite sources when possible
-3. If the context doesn't contain the answer, say so
-4. Keep your answer concise and relevant
-5. Maintain conversation continuity if there's previous context
-6. No special characters and response should be in plain text
-Answer:"""
-            
             # Get response from LLM
-            response = self.call_llm_api(prompt)
+            response = await self.call_llm_api(user_content)
             
             # Prepare source information
             sources = [
@@ -260,10 +476,15 @@ Answer:"""
     
     def is_connected(self) -> bool:
         """
-        Check if connected to Pinecone
+        Check if connected to Pinecone (cached for 10s to keep frequent
+        liveness probes from spending a Pinecone round-trip each)
         """
+        now = time.monotonic()
+        if now - self._last_ok < 10:
+            return True
         try:
             self.index.describe_index_stats()
+            self._last_ok = now
             return True
         except:
             return False
@@ -274,5 +495,7 @@ Answer:"""
         """
         try:
             self.index.delete(filter={"job_id": job_id})
+            with self._ctx_cache_lock:
+                self._ctx_cache.clear()
         except Exception as e:
             raise Exception(f"Error deleting job data: {str(e)}")
@@ -0,0 +1,107 @@
+import os
+import json
+from typing import List, Optional
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# TTLs for stored state
+JOB_TTL = 86400      # 24 hours
+SESSION_TTL = 3600   # 1 hour
+
+class StateStore:
+    """
+    Shared storage for job status and chat sessions.
+
+    Uses Redis when REDIS_URL is set, so any uvicorn worker can serve
+    /upload-status and /chat regardless of which worker handled the upload.
+    Falls back to process-local dicts for single-worker development runs.
+    """
+
+    def __init__(self):
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url and aioredis:
+            self.redis = aioredis.from_url(redis_url, decode_responses=True)
+        else:
+            self.redis = None
+        # In-memory fallback with the same TTLs Redis applies via EXPIRE,
+        # so completed jobs and idle sessions don't accumulate forever
+        self._jobs: TTLCache = TTLCache(maxsize=10_000, ttl=JOB_TTL)
+        self._sessions: TTLCache = TTLCache(maxsize=10_000, ttl=SESSION_TTL)
+
+    # --- Job status ---
+
+    async def set_job(self, job_id: str, status: dict):
+        if self.redis:
+            key = f"job:{job_id}"
+            await self.redis.hset(key, mapping={k: json.dumps(v) for k, v in status.items()})
+            await self.redis.expire(key, JOB_TTL)
+        else:
+            self._jobs[job_id] = status
+
+    async def update_job(self, job_id: str, **fields):
+        if self.redis:
+            key = f"job:{job_id}"
+            await self.redis.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+            # hset on an expired key would recreate it without a TTL
+            await self.redis.expire(key, JOB_TTL)
+        else:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        if self.redis:
+            data = await self.redis.hgetall(f"job:{job_id}")
+            if not data:
+                return None
+            return {k: json.loads(v) for k, v in data.items()}
+        else:
+            return self._jobs.get(job_id)
+
+    async def job_count(self) -> int:
+        if self.redis:
+            count = 0
+            async for _ in self.redis.scan_iter("job:*"):
+                count += 1
+            return count
+        else:
+            return len(self._jobs)
+
+    # --- Chat sessions ---
+
+    async def append_message(self, session_id: str, message: dict):
+        if self.redis:
+            key = f"sess:{session_id}"
+            await self.redis.rpush(key, json.dumps(message))
+            await self.redis.expire(key, SESSION_TTL)
+        else:
+            self._sessions.setdefault(session_id, []).append(message)
+
+    async def get_history(self, session_id: str) -> List[dict]:
+        if self.redis:
+            items = await self.redis.lrange(f"sess:{session_id}", 0, -1)
+            return [json.loads(item) for item in items]
+        else:
+            return self._sessions.get(session_id, [])
+
+    async def clear_session(self, session_id: str):
+        if self.redis:
+            await self.redis.delete(f"sess:{session_id}")
+        else:
+            self._sessions[session_id] = []
+
+    async def session_count(self) -> int:
+        if self.redis:
+            count = 0
+            async for _ in self.redis.scan_iter("sess:*"):
+                count += 1
+            return count
+        else:
+            return len(self._sessions)